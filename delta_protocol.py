@@ -0,0 +1,87 @@
+import numpy as np
+
+# Protocol v2 (delta encoding), which needs matching ESP32 firmware. Right after
+# connecting, a single PROTOCOL_V2 byte is sent. Every message then starts with a
+# type byte: MSG_FULL_FRAME is followed by the raw RGB565 half-frame, MSG_DELTA_FRAME
+# by a varint count of changed tiles and, for each DELTA_TILE_SIZE x DELTA_TILE_SIZE
+# tile that changed, its varint index (row-major) and its RGB565 bytes (row-major).
+PROTOCOL_V2 = 0x02
+MSG_FULL_FRAME = 0x00
+MSG_DELTA_FRAME = 0x01
+DELTA_TILE_SIZE = 8
+
+# Width in pixels of the half-frames sent to each ESP32
+FRAME_WIDTH = 64 * 4
+
+# Encode a non-negative integer as an unsigned LEB128 varint
+def encode_varint(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return encoded
+
+# Decode an unsigned LEB128 varint starting at offset; returns (value, next offset)
+def decode_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+# Split an RGB565 payload of the given width into row-major tiles, or return None
+# if the frame isn't a whole number of tiles
+def split_tiles(payload, width):
+    tile = DELTA_TILE_SIZE
+    if width % tile or len(payload) % (2 * width):
+        return None
+    height = len(payload) // (2 * width)
+    if height % tile:
+        return None
+    pixels = np.frombuffer(payload, dtype=np.uint16).reshape(height, width)
+    return pixels.reshape(height // tile, tile, width // tile, tile).swapaxes(1, 2).reshape(-1, tile, tile)
+
+# Encode a half-frame payload against the previously sent payload. Falls back to a
+# full frame when there is no baseline, the frame isn't tile-aligned or the delta
+# isn't smaller.
+def encode_delta_frame(payload, previous_payload, width=FRAME_WIDTH):
+    full_frame = bytes([MSG_FULL_FRAME]) + payload
+    if previous_payload is None or len(previous_payload) != len(payload):
+        return full_frame
+
+    current_tiles = split_tiles(payload, width)
+    if current_tiles is None:
+        return full_frame
+    changed = np.flatnonzero((current_tiles != split_tiles(previous_payload, width)).any(axis=(1, 2)))
+
+    delta_frame = bytearray([MSG_DELTA_FRAME]) + encode_varint(len(changed))
+    for index in changed:
+        delta_frame += encode_varint(int(index))
+        delta_frame += current_tiles[index].tobytes()
+    return bytes(delta_frame) if len(delta_frame) < len(full_frame) else full_frame
+
+# Apply a protocol v2 message to the previously shown payload and return the new
+# payload, as the ESP32 firmware does
+def decode_delta_frame(message, previous_payload, width=FRAME_WIDTH):
+    if message[0] == MSG_FULL_FRAME:
+        return bytes(message[1:])
+    if message[0] != MSG_DELTA_FRAME:
+        raise ValueError(f"Unknown message type {message[0]:#04x}")
+
+    tile = DELTA_TILE_SIZE
+    tiles_per_row = width // tile
+    tile_bytes = tile * tile * 2
+    pixels = np.frombuffer(previous_payload, dtype=np.uint16).reshape(-1, width).copy()
+    count, offset = decode_varint(message, 1)
+    for _ in range(count):
+        index, offset = decode_varint(message, offset)
+        y, x = divmod(index, tiles_per_row)
+        tile_pixels = np.frombuffer(message, dtype=np.uint16, count=tile * tile, offset=offset)
+        pixels[y * tile:(y + 1) * tile, x * tile:(x + 1) * tile] = tile_pixels.reshape(tile, tile)
+        offset += tile_bytes
+    return pixels.tobytes()
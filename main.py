@@ -3,6 +3,11 @@ import websockets
 import asyncio
 import numpy as np
 import threading
+import logging
+import os
+import socket
+import concurrent.futures
+import functools
 from kivy.app import App
 from kivy.uix.button import Button
 from kivy.uix.boxlayout import BoxLayout
@@ -14,118 +19,302 @@ from kivy.uix.popup import Popup
 from kivy.uix.colorpicker import ColorPicker
 from kivy.graphics import Color, Rectangle
 
+from delta_protocol import PROTOCOL_V2, encode_delta_frame
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (not available on Windows)
+    uvloop = None
+
+log = logging.getLogger(__name__)
+
 # WebSocket URIs for the two ESP32 devices
 URI_ESP32_1 = "ws://192.168.230.205:81"  # ESP32_1 (e.g., bottom part)
 URI_ESP32_2 = "ws://192.168.230.171:81"  # ESP32_2 (e.g., top part)
 
-# Global flag for streaming status
-streaming = False
+# Byte order of the RGB565 words on the wire. The ESP32 firmware currently takes
+# little-endian words; set this for panels that expect big-endian (network order)
+# so the swap is done on the host in one vectorized pass instead of per pixel on the MCU.
+PANEL_BIG_ENDIAN = False
+
+# Send frames with the optional delta-encoded protocol v2 (see delta_protocol.py),
+# which needs matching ESP32 firmware
+DELTA_ENCODING = False
+
+# Seconds to wait for both ESP32s to answer a frame with 'K' before the links are
+# treated as dead and closed, so the run reconnects
+K_TIMEOUT = 10
+
+# Seconds to keep waiting for an outstanding 'K' after Stop before the links are reset
+K_DRAIN_TIMEOUT = 0.5
+
+# Seconds to wait after a connection error before reconnecting
+RECONNECT_DELAY = 1
 
-# Convert an RGB tuple to a 16-bit RGB565 value
+# Raised when the ESP32s don't both answer a frame with 'K' within K_TIMEOUT
+class KTimeoutError(Exception):
+    pass
+
+# Open WebSocket connections per ESP32 URI, reused across runs (see get_connection)
+_connections = {}
+
+# Last payload sent to each connection, the baseline for delta encoding
+_previous_payloads = {}
+
+# Worker that prepares the next frame while the current one is sent. One worker is
+# enough: OpenCV releases the GIL while decoding and resizing.
+_prepare_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# Scratch arrays for load_frame's resize and RGB565 packing, reused across frames.
+# load_frame only runs on the single _prepare_executor thread, so one set is enough.
+_resized_buffer = np.empty((128 * 2, 64 * 4, 3), dtype=np.uint8)
+_packed_buffer = np.empty((128 * 2, 64 * 4, 2), dtype=np.uint8)
+
+# Convert an RGB tuple to a 16-bit RGB565 value (scalar helper, not used on the hot path)
 def rgb_to_rgb565(r, g, b):
     r_565 = np.uint16(r & 0xF8) << 8  # Red component to 5 bits
     g_565 = np.uint16(g & 0xFC) << 3  # Green component to 6 bits
     b_565 = np.uint16(b) >> 3         # Blue component to 5 bits
     return r_565 | g_565 | b_565
 
-# Function to send the frame data in smaller chunks
-async def send_frame_data(websocket, frame_rgb565, chunk_size=1024 * 8):
-    frame_bytes = frame_rgb565.tobytes()  # Convert the frame to bytes
-    for i in range(0, len(frame_bytes), chunk_size):
-        chunk = frame_bytes[i:i + chunk_size]
-        await websocket.send(chunk)  # Send data in chunks
+# Swap RGB565 words to big-endian in place when PANEL_BIG_ENDIAN is set. Accepts
+# uint16 arrays and OpenCV's (H x W x 2) uint8 BGR565 output; returns the same array.
+def to_panel_byte_order(frame_rgb565):
+    if PANEL_BIG_ENDIAN:
+        frame_rgb565.view(np.uint16).byteswap(inplace=True)
+    return frame_rgb565
+
+# Function to send one half-frame payload (bytes) to a specific ESP32 device,
+# delta-encoded against the previous payload when protocol v2 is enabled
+async def send_payload(websocket, payload):
+    if not DELTA_ENCODING:
+        await websocket.send(payload)
+        return
 
-# Function to send image data to a specific ESP32 device
-async def send_image_part(websocket, image_part):
-    try:
-        # Convert the image part to RGB565 format (16-bit per pixel)
-        image_rgb565 = np.zeros((image_part.shape[0], image_part.shape[1]), dtype=np.uint16)
-        for y in range(image_part.shape[0]):
-            for x in range(image_part.shape[1]):
-                r, g, b = image_part[y, x]
-                image_rgb565[y, x] = rgb_to_rgb565(r, g, b)
-
-        # Send the image data to the ESP32 in chunks
-        await send_frame_data(websocket, image_rgb565)
-        print("Image part sent successfully")
-
-    except Exception as e:
-        print(f"Error sending image part: {e}")
-
-# Function to send images to both ESP32 devices simultaneously
-async def send_image(image_path, websocket1, websocket2):
+    message = encode_delta_frame(payload, _previous_payloads.get(websocket))
+    _previous_payloads[websocket] = payload
+    await websocket.send(message)
+
+# Load an image and pack it into (top, bottom) RGB565 payloads for the two ESP32s,
+# or None if it can't be loaded. LRU-cached on (path, mtime) so steady-state streaming
+# never decodes, resizes or converts again, and an edited file is picked up on its next
+# mtime. Only the packed payloads (64 KB per half) are kept, not the decoded images.
+@functools.lru_cache(maxsize=64)
+def load_frame(image_path, mtime):
     # Read the image from the file
     image = cv2.imread(image_path)
     if image is None:
-        print(f"Error: Unable to load image {image_path}.")
-        return
-
-    # Resize the image to match the ESP32 panel resolution (192x128)
-    image_resized = cv2.resize(image, (64 * 4, 128 * 2))
-    image_rgb = cv2.cvtColor(image_resized, cv2.COLOR_BGR2RGB)
+        log.error("Unable to load image %s.", image_path)
+        return None
+
+    # Resize the image to match the ESP32 panel resolution (192x128). INTER_AREA avoids
+    # the aliasing INTER_LINEAR gives on large downscales; it is slower, but each image
+    # is only resized once thanks to the frame cache. Keep INTER_LINEAR when enlarging.
+    downscaling = image.shape[0] >= 128 * 2 and image.shape[1] >= 64 * 4
+    image_resized = cv2.resize(image, (64 * 4, 128 * 2),
+                               dst=_resized_buffer,
+                               interpolation=cv2.INTER_AREA if downscaling else cv2.INTER_LINEAR)
+
+    # Pack straight from BGR to 16-bit RGB565 in one OpenCV pass. OpenCV's BGR565
+    # layout puts red in the high bits, so the bytes match rgb_to_rgb565 exactly.
+    image_packed = cv2.cvtColor(image_resized, cv2.COLOR_BGR2BGR565,
+                                dst=_packed_buffer)
+
+    # Split the packed image into top and bottom parts
+    to_panel_byte_order(image_packed)
+    return (image_packed[:128].tobytes(), image_packed[128:].tobytes())
+
+# Return the (top, bottom) RGB565 payloads for an image file, or None if it can't be loaded
+def prepare_frame(image_path):
+    try:
+        mtime = os.path.getmtime(image_path)
+    except OSError:
+        log.error("Unable to load image %s.", image_path)
+        return None
+    return load_frame(image_path, mtime)
 
-    # Split the image into top and bottom parts
-    image_top = image_rgb[:128, :]  # Top part (192x64)
-    image_bottom = image_rgb[128:, :]  # Bottom part (192x64)
+# Function to send a prepared (top, bottom) frame to both ESP32 devices simultaneously
+async def send_frame(frame, websocket1, websocket2):
+    top_bytes, bottom_bytes = frame
 
     # Send the top part to ESP32_2 and the bottom part to ESP32_1 simultaneously
     await asyncio.gather(
-        send_image_part(websocket2, image_top),        # Send top part to ESP32_2
-        send_image_part(websocket1, image_bottom)      # Send bottom part to ESP32_1 without rotation
+        send_payload(websocket2, top_bytes),        # Send top part to ESP32_2
+        send_payload(websocket1, bottom_bytes)      # Send bottom part to ESP32_1 without rotation
     )
 
+# Function to wait until a single ESP32 sends "K"
+async def wait_for_K(websocket, name):
+    while await websocket.recv() != "K":
+        pass
+    log.debug("Received 'K' from %s", name)
+    return name
+
 # Function to listen for "K" from both ESP32s
 async def listen_for_K(websocket1, websocket2):
-    received_K1 = False
-    received_K2 = False
-
-    while not (received_K1 and received_K2):
-        if not received_K1:
-            response1 = await websocket1.recv()
-            if response1 == "K":
-                print("Received 'K' from ESP32_1")
-                received_K1 = True
-
-        if not received_K2:
-            response2 = await websocket2.recv()
-            if response2 == "K":
-                print("Received 'K' from ESP32_2")
-                received_K2 = True
-
-    return received_K1 and received_K2
-
-# Function to manage WebSocket connections and image streaming
-async def websocket_communication(image_paths, delay_between_images):
+    # Wait on both sockets at once so whichever ESP32 answers first is handled first
+    pending = {
+        asyncio.create_task(wait_for_K(websocket1, "ESP32_1")),
+        asyncio.create_task(wait_for_K(websocket2, "ESP32_2")),
+    }
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # Re-raise connection errors
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return True
+
+# Open a WebSocket connection to an ESP32, tuned for streaming frames over the LAN
+async def connect_esp32(uri):
+    # RGB565 pixel data barely compresses, so skip permessage-deflate. Connections stay
+    # open between runs, so keep infrequent keepalive pings to notice a dead ESP32.
+    websocket = await websockets.connect(uri, timeout=10, compression=None, ping_interval=30,
+                                         ping_timeout=30, max_size=None)
+
+    # Flush each frame immediately instead of letting Nagle's algorithm hold it back
+    sock = websocket.transport.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # Announce protocol v2 so the ESP32 expects typed (full/delta) messages
+    if DELTA_ENCODING:
+        await websocket.send(bytes([PROTOCOL_V2]))
+    return websocket
+
+# Return the open connection to an ESP32, connecting only if there is none yet.
+# Connections are kept open between runs so pressing Run again starts immediately.
+async def get_connection(uri):
+    websocket = _connections.get(uri)
+    if websocket is None or websocket.close_code is not None:
+        _previous_payloads.pop(websocket, None)
+        websocket = _connections[uri] = await connect_esp32(uri)
+    return websocket
+
+# Close and forget all ESP32 connections so the next run reconnects from scratch
+async def reset_connections():
+    connections = list(_connections.values())
+    _connections.clear()
+    _previous_payloads.clear()
+    for websocket in connections:
+        await websocket.close()
+
+# Sleep for delay seconds, waking up early if stop_event is set
+async def wait_or_stop(stop_event, delay):
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=delay)
+    except asyncio.TimeoutError:
+        pass
+
+# Await awaitable unless stop_event is set first, in which case it is cancelled.
+# Returns True if it finished (re-raising its errors), False if Stop interrupted it.
+async def until_stopped(stop_event, awaitable):
+    task = asyncio.ensure_future(awaitable)
+    stop = asyncio.ensure_future(stop_event.wait())
     try:
-        async with websockets.connect(URI_ESP32_1, timeout=10) as websocket1, \
-                   websockets.connect(URI_ESP32_2, timeout=10) as websocket2:
-            while streaming:
-                for image_path in image_paths:
-                    if image_path:  # Only process valid image paths
-                        print(f"Sending image: {image_path}")
-                        await send_image(image_path, websocket1, websocket2)
-
-                        # Listen for 'K' before sending 'P'
-                        print("Waiting for 'K' from both ESP32 devices...")
-                        if await listen_for_K(websocket1, websocket2):
-                            print("Received 'K'. Sending 'P'...")
-
-                            await asyncio.gather(
-                                websocket1.send('P'),
-                                websocket2.send('P')
-                            )
-
-                        await asyncio.sleep(delay_between_images)
-                    if not streaming:
+        await asyncio.wait({task, stop}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stop.cancel()
+        if not task.done():
+            # Don't wait for it to unwind: websockets may finish a cancelled handshake
+            # only after its own timeout. Just consume whatever it ends with.
+            task.cancel()
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    if not task.done() or task.cancelled():
+        return False
+    task.result()
+    return True
+
+# Connect to both ESP32s (reusing open links) and send them one frame
+async def send_to_both(frame):
+    websocket1 = await get_connection(URI_ESP32_1)
+    websocket2 = await get_connection(URI_ESP32_2)
+    await send_frame(frame, websocket1, websocket2)
+    return websocket1, websocket2
+
+# Wait for both ESP32s to answer 'K', then send 'P' to show the frame
+async def acknowledge_frame(websocket1, websocket2):
+    # Listen for 'K' before sending 'P'
+    log.debug("Waiting for 'K' from both ESP32 devices...")
+    try:
+        await asyncio.wait_for(listen_for_K(websocket1, websocket2), K_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise KTimeoutError(f"No 'K' from both ESP32 devices within {K_TIMEOUT} s") from None
+    log.debug("Received 'K'. Sending 'P'...")
+
+    await asyncio.gather(
+        websocket1.send('P'),
+        websocket2.send('P')
+    )
+
+# Send one frame to both ESP32s and complete its K/P exchange. Returns False if Stop
+# interrupted it, after resetting any links it left out of step.
+async def exchange_frame(frame, stop_event):
+    sending = asyncio.ensure_future(send_to_both(frame))
+    if not await until_stopped(stop_event, sending):
+        # Stopped while connecting or mid-frame: start over on fresh connections
+        await reset_connections()
+        return False
+
+    acknowledging = asyncio.ensure_future(acknowledge_frame(*sending.result()))
+    if not await until_stopped(stop_event, asyncio.shield(acknowledging)):
+        # The frame is out and the ESP32s owe its 'K'. Give them K_DRAIN_TIMEOUT to
+        # finish the exchange so the links stay in step and can be reused; a late 'K'
+        # would otherwise be read as the next frame's. Reset only if that fails.
+        try:
+            await asyncio.wait_for(acknowledging, K_DRAIN_TIMEOUT)
+        except Exception:
+            await reset_connections()
+        return False
+    return True
+
+# Function to manage WebSocket connections and image streaming until stop_event is set.
+# Errors don't end the run: the links are reset and it reconnects until Stop, so a Run
+# pressed while it recovers is never lost.
+async def websocket_communication(image_paths, delay_between_images, stop_event):
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        valid_paths = [path for path in image_paths if path]  # Only process valid image paths
+        if not valid_paths:
+            await wait_or_stop(stop_event, delay_between_images)
+            continue
+
+        try:
+            # Prepare the first image, then always prepare the next one on the
+            # worker thread while the current one is sent and acknowledged
+            next_frame = loop.run_in_executor(_prepare_executor, prepare_frame, valid_paths[0])
+            for index, image_path in enumerate(valid_paths):
+                frame = await next_frame
+                if index + 1 < len(valid_paths):
+                    next_frame = loop.run_in_executor(_prepare_executor, prepare_frame, valid_paths[index + 1])
+
+                if frame is not None:
+                    log.debug("Sending image: %s", image_path)
+                    # Stop interrupts the exchange at any point
+                    if not await exchange_frame(frame, stop_event):
                         break
-    except Exception as e:
-        print(f"WebSocket error: {e}")
 
-# Start WebSocket communication in a separate thread
-def start_websocket_thread(image_paths):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(websocket_communication(image_paths, 0.05))
+                    await wait_or_stop(stop_event, delay_between_images)
+                if stop_event.is_set():
+                    break
+        except KTimeoutError as e:
+            log.error("%s; reconnecting.", e)
+            await reset_connections()
+            await wait_or_stop(stop_event, RECONNECT_DELAY)
+        except Exception as e:
+            log.error("WebSocket error: %r; reconnecting.", e)
+            await reset_connections()
+            await wait_or_stop(stop_event, RECONNECT_DELAY)
+
+# Start a long-lived event loop for WebSocket communication in a background thread
+def start_event_loop_thread():
+    # Use the libuv-based loop when available; it cuts per-send event loop overhead
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
 
 class ImageSenderApp(App):
     def build(self):
@@ -210,6 +399,12 @@ class ImageSenderApp(App):
 
         return layout
 
+    def on_start(self):
+        # One event loop thread serves every Run, so connections stay warm between runs
+        self.loop = start_event_loop_thread()
+        self.streaming_task = None
+        self.stop_event = asyncio.Event()
+
     def _update_rect(self, instance, value):
         self.rect.pos = instance.pos
         self.rect.size = instance.size
@@ -251,13 +446,23 @@ class ImageSenderApp(App):
         self.labels[index].text = f"Image {index + 1}: No file selected"
 
     def start_streaming(self, instance):
-        global streaming
-        streaming = True
-        threading.Thread(target=start_websocket_thread, args=(self.image_paths,), daemon=True).start()
+        self.loop.call_soon_threadsafe(self._start_run)
+
+    def _start_run(self):
+        # Runs on the event loop thread. A run that is still winding down after
+        # Stop, or recovering from an error, simply carries on once the stop event
+        # is cleared.
+        self.stop_event.clear()
+        if self.streaming_task is None or self.streaming_task.done():
+            self.streaming_task = self.loop.create_task(
+                websocket_communication(self.image_paths, 0.05, self.stop_event)
+            )
 
     def stop_streaming(self, instance):
-        global streaming
-        streaming = False
+        # Interrupts the run immediately, whether it is connecting, sending, waiting for K or sleeping
+        self.loop.call_soon_threadsafe(self.stop_event.set)
 
 if __name__ == "__main__":
+    # Keep debug logging off the send path unless explicitly enabled
+    logging.basicConfig(level=logging.WARNING)
     ImageSenderApp().run()
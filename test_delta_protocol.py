@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+
+from delta_protocol import (
+    DELTA_TILE_SIZE, FRAME_WIDTH, MSG_DELTA_FRAME, MSG_FULL_FRAME,
+    decode_delta_frame, decode_varint, encode_delta_frame, encode_varint,
+)
+
+
+def random_frame(rng, height, width=FRAME_WIDTH):
+    return rng.integers(0, 1 << 16, size=(height, width), dtype=np.uint16)
+
+
+class VarintTest(unittest.TestCase):
+    def test_round_trip(self):
+        for value in (0, 1, 127, 128, 300, 511, 16383, 16384, 1 << 20):
+            encoded = encode_varint(value)
+            self.assertEqual(decode_varint(encoded, 0), (value, len(encoded)))
+
+    def test_known_encoding(self):
+        self.assertEqual(bytes(encode_varint(300)), bytes([0xAC, 0x02]))
+
+
+class DeltaFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_first_frame_is_full(self):
+        frame = random_frame(self.rng, 128).tobytes()
+        message = encode_delta_frame(frame, None)
+        self.assertEqual(message[0], MSG_FULL_FRAME)
+        self.assertEqual(decode_delta_frame(message, None), frame)
+
+    def test_partial_change_round_trips_as_delta(self):
+        previous = random_frame(self.rng, 128)
+        current = previous.copy()
+        current[10:20, 100:150] = 5
+        current[-1, -1] ^= 1
+        message = encode_delta_frame(current.tobytes(), previous.tobytes())
+        self.assertEqual(message[0], MSG_DELTA_FRAME)
+        self.assertLess(len(message), current.nbytes)
+        self.assertEqual(decode_delta_frame(message, previous.tobytes()), current.tobytes())
+
+    def test_unchanged_frame_sends_no_tiles(self):
+        frame = random_frame(self.rng, 128).tobytes()
+        message = encode_delta_frame(frame, frame)
+        self.assertEqual(message, bytes([MSG_DELTA_FRAME, 0]))
+        self.assertEqual(decode_delta_frame(message, frame), frame)
+
+    def test_fully_changed_frame_falls_back_to_full(self):
+        previous = random_frame(self.rng, 128).tobytes()
+        current = random_frame(self.rng, 128).tobytes()
+        message = encode_delta_frame(current, previous)
+        self.assertEqual(message[0], MSG_FULL_FRAME)
+        self.assertEqual(decode_delta_frame(message, previous), current)
+
+    def test_frame_not_tile_aligned_falls_back_to_full(self):
+        height = 100  # Not a multiple of DELTA_TILE_SIZE
+        self.assertNotEqual(height % DELTA_TILE_SIZE, 0)
+        previous = random_frame(self.rng, height)
+        current = previous.copy()
+        current[0, 0] ^= 1
+        message = encode_delta_frame(current.tobytes(), previous.tobytes())
+        self.assertEqual(message[0], MSG_FULL_FRAME)
+        self.assertEqual(decode_delta_frame(message, previous.tobytes()), current.tobytes())
+
+    def test_other_width(self):
+        previous = random_frame(self.rng, 64, width=128)
+        current = previous.copy()
+        current[40:48, 8:16] = 0
+        message = encode_delta_frame(current.tobytes(), previous.tobytes(), width=128)
+        self.assertEqual(message[0], MSG_DELTA_FRAME)
+        self.assertEqual(decode_delta_frame(message, previous.tobytes(), width=128), current.tobytes())
+
+    def test_width_not_tile_aligned_falls_back_to_full(self):
+        previous = random_frame(self.rng, 16, width=100)
+        current = previous.copy()
+        current[0, 0] ^= 1
+        message = encode_delta_frame(current.tobytes(), previous.tobytes(), width=100)
+        self.assertEqual(message[0], MSG_FULL_FRAME)
+
+
+if __name__ == "__main__":
+    unittest.main()